@@ -7920,40 +7920,44 @@ pub async fn serve_upload(Path(file_id): Path<String>) -> impl IntoResponse {
 
     let file_path = std::env::temp_dir().join("openfang_uploads").join(&file_id);
 
-    // Look up metadata from registry; fall back to disk probe for generated images
-    // (image_generate saves files without registering in UPLOAD_REGISTRY).
+    let data = match std::fs::read(&file_path) {
+        Ok(data) => data,
+        Err(_) => {
+            return (
+                StatusCode::NOT_FOUND,
+                [(
+                    axum::http::header::CONTENT_TYPE,
+                    "application/json".to_string(),
+                )],
+                b"{\"error\":\"File not found\"}".to_vec(),
+            );
+        }
+    };
+
+    // Look up metadata from registry; fall back to magic bytes for generated images
+    // and browser screenshots (saved without registering in UPLOAD_REGISTRY).
     let content_type = match UPLOAD_REGISTRY.get(&file_id) {
         Some(m) => m.content_type.clone(),
-        None => {
-            // Infer content type from file magic bytes
-            if !file_path.exists() {
-                return (
-                    StatusCode::NOT_FOUND,
-                    [(
-                        axum::http::header::CONTENT_TYPE,
-                        "application/json".to_string(),
-                    )],
-                    b"{\"error\":\"File not found\"}".to_vec(),
-                );
-            }
-            "image/png".to_string()
-        }
+        None => sniff_image_content_type(&data).to_string(),
     };
 
-    match std::fs::read(&file_path) {
-        Ok(data) => (
-            StatusCode::OK,
-            [(axum::http::header::CONTENT_TYPE, content_type)],
-            data,
-        ),
-        Err(_) => (
-            StatusCode::NOT_FOUND,
-            [(
-                axum::http::header::CONTENT_TYPE,
-                "application/json".to_string(),
-            )],
-            b"{\"error\":\"File not found on disk\"}".to_vec(),
-        ),
+    (
+        StatusCode::OK,
+        [(axum::http::header::CONTENT_TYPE, content_type)],
+        data,
+    )
+}
+
+/// Infer an image MIME type from magic bytes, defaulting to PNG.
+fn sniff_image_content_type(data: &[u8]) -> &'static str {
+    if data.starts_with(b"\xFF\xD8\xFF") {
+        "image/jpeg"
+    } else if data.starts_with(b"GIF8") {
+        "image/gif"
+    } else if data.len() >= 12 && data.starts_with(b"RIFF") && &data[8..12] == b"WEBP" {
+        "image/webp"
+    } else {
+        "image/png"
     }
 }
 
@@ -4,16 +4,63 @@
 Reads JSON commands from stdin (one per line), executes browser actions via
 Playwright, and writes JSON responses to stdout (one per line).
 
+Commands may carry an optional "session_id" (each session gets its own browser
+context and page; the default session is "") and an optional "id" that is
+echoed back in the response. Commands for different sessions run concurrently.
+
+Navigate accepts an optional "wait": "none" (default — return as soon as the
+response commits and <body> exists), "dom", "load" or "idle". With "none" the
+content reflects the page as parsed so far; issue ReadPage to refresh it.
+Screenshot accepts an optional "format": "jpeg" (default, quality 70) or "png".
+Batch runs a list of commands ("steps") in order on one page and returns their
+responses in "results", stopping at the first failure unless "stopOnError" is
+false.
+
+With --profile-dir (or OPENFANG_PW_PROFILE) Chromium runs from a persistent
+profile, so HTTP cache, cookies and service workers survive between bridge
+processes. All sessions then share that profile, each with its own page. If the
+profile is locked by another bridge, a throwaway browser is used instead.
+
 Usage:
     python browser_bridge.py [--headless] [--width 1280] [--height 720] [--timeout 30]
+                             [--profile-dir DIR]
 """
 
 import argparse
-import base64
+import asyncio
+import binascii
 import json
-import re
+import os
+import stat
 import sys
-import traceback
+import weakref
+
+# orjson is optional; it is several times faster than the stdlib on every
+# command decode and response encode.
+def _json_dumps(obj):
+    return json.dumps(obj).encode("utf-8")
+
+
+try:
+    import orjson
+except ImportError:
+    _loads = json.loads
+    _dumps = _json_dumps
+else:
+    _loads = orjson.loads
+
+    def _dumps(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. ints wider than 64 bits, which only the stdlib encodes
+            return _json_dumps(obj)
+
+# Navigate "wait" values -> Playwright wait_until states
+NAVIGATE_WAIT = {"none": "commit", "dom": "domcontentloaded", "load": "load", "idle": "networkidle"}
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
 
 def main():
     parser = argparse.ArgumentParser(description="OpenFang Browser Bridge")
@@ -22,76 +69,206 @@ def main():
     parser.add_argument("--width", type=int, default=1280)
     parser.add_argument("--height", type=int, default=720)
     parser.add_argument("--timeout", type=int, default=30)
+    parser.add_argument("--profile-dir", default=os.environ.get("OPENFANG_PW_PROFILE", ""))
     args = parser.parse_args()
 
+    asyncio.run(run_bridge(args))
+
+
+async def run_bridge(args):
     timeout_ms = args.timeout * 1000
 
     try:
-        from playwright.sync_api import sync_playwright
+        from playwright.async_api import async_playwright
     except ImportError:
         respond({"success": False, "error": "playwright not installed. Run: pip install playwright && playwright install chromium"})
         return
 
-    pw = sync_playwright().start()
-    browser = pw.chromium.launch(headless=args.headless)
-    context = browser.new_context(
-        viewport={"width": args.width, "height": args.height},
-        user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    )
-    page = context.new_page()
-    page.set_default_timeout(timeout_ms)
-    page.set_default_navigation_timeout(timeout_ms)
+    pw = await async_playwright().start()
+    context_options = {
+        "viewport": {"width": args.width, "height": args.height},
+        "user_agent": USER_AGENT,
+    }
+    persistent = None
+    if args.profile_dir:
+        try:
+            persistent = await pw.chromium.launch_persistent_context(
+                args.profile_dir, headless=args.headless, **context_options
+            )
+        except Exception:
+            # Profile in use by another bridge process (or unusable): run ephemeral
+            persistent = None
+    browser = None if persistent is not None else await pw.chromium.launch(headless=args.headless)
+
+    # One browser, one context/page per session_id (one page per session_id in
+    # the shared persistent context). Commands for different sessions run
+    # concurrently; commands within a session keep their order.
+    sessions = {}
+
+    def get_session(session_id):
+        session = sessions.get(session_id)
+        if session is None:
+            session = {"context": None, "page": None, "lock": asyncio.Lock()}
+            sessions[session_id] = session
+        return session
+
+    async def open_page(session):
+        # Called with the session lock held, so a context is only created once
+        if session["page"] is None:
+            if persistent is not None:
+                context = persistent
+                # Reuse the blank tab a persistent launch opens
+                unused = [p for p in context.pages if all(s["page"] is not p for s in sessions.values())]
+                page = unused[0] if unused else await context.new_page()
+            else:
+                context = await browser.new_context(**context_options)
+                page = await context.new_page()
+            page.set_default_timeout(timeout_ms)
+            page.set_default_navigation_timeout(timeout_ms)
+            session["context"] = context
+            session["page"] = page
+        return session["page"]
+
+    async def close_session(session):
+        if session["context"] is persistent:
+            if session["page"] is not None:
+                await session["page"].close()
+        elif session["context"] is not None:
+            await session["context"].close()
+        session["page"] = session["context"] = None
+
+    async def run_command(cmd):
+        action = cmd.get("action", "")
+        session_id = cmd.get("session_id", "")
+        try:
+            while True:
+                session = get_session(session_id)
+                async with session["lock"]:
+                    # A Close that ran while we waited removed this entry;
+                    # start over on a fresh session instead of the closed one.
+                    if sessions.get(session_id) is not session:
+                        continue
+                    if action == "Close" and session_id:
+                        sessions.pop(session_id, None)
+                        await close_session(session)
+                        result = {"success": True, "data": {"status": "closed"}}
+                    else:
+                        page = await open_page(session)
+                        result = await handle_command(page, session["context"], action, cmd, timeout_ms)
+                    break
+        except Exception as e:
+            result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+        if "id" in cmd:
+            result["id"] = cmd["id"]
+        respond(result)
+
+    # Open the default session up front so "ready" means a page is available
+    await open_page(get_session(""))
 
     # Signal ready
     respond({"success": True, "data": {"status": "ready"}})
 
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
+    pending = set()
+    async for line in read_lines():
+        # _loads takes the raw bytes and tolerates the trailing newline
+        if line.isspace():
             continue
-        action = None
         try:
-            cmd = json.loads(line)
-            action = cmd.get("action", "")
-            result = handle_command(page, context, action, cmd, timeout_ms)
-            respond(result)
+            cmd = _loads(line)
         except Exception as e:
             respond({"success": False, "error": f"{type(e).__name__}: {e}"})
+            continue
+        if not isinstance(cmd, dict):
+            respond({"success": False, "error": "Command must be a JSON object"})
+            continue
 
-        if action == "Close":
+        # Closing the default session shuts the bridge down once in-flight
+        # commands have finished.
+        if cmd.get("action") == "Close" and not cmd.get("session_id"):
+            if pending:
+                await asyncio.wait(pending)
+            await run_command(cmd)
             break
 
+        task = asyncio.create_task(run_command(cmd))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
     # Cleanup
     try:
-        context.close()
-        browser.close()
-        pw.stop()
+        if pending:
+            await asyncio.wait(pending)
+        for session in sessions.values():
+            await close_session(session)
+        if persistent is not None:
+            await persistent.close()
+        else:
+            await browser.close()
+        await pw.stop()
     except Exception:
         pass
 
 
-def handle_command(page, context, action, cmd, timeout_ms):
+async def read_lines():
+    """Yield raw stdin lines (bytes) without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Proactor loops cannot attach to an inherited stdin pipe, and the selector
+    # loop rejects regular files and devices like /dev/null; read those on a
+    # worker thread.
+    mode = os.fstat(sys.stdin.fileno()).st_mode
+    if sys.platform == "win32" or not (stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode)):
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.buffer.readline)
+            if not line:
+                return
+            yield line
+    else:
+        reader = asyncio.StreamReader(limit=2 ** 24)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield line
+
+
+async def handle_command(page, context, action, cmd, timeout_ms):
     if action == "Navigate":
         url = cmd.get("url", "")
         if not url:
             return {"success": False, "error": "Missing 'url' parameter"}
-        page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
-        title = page.title()
-        content = extract_readable(page)
-        return {"success": True, "data": {"title": title, "url": page.url, "content": content}}
+        wait_until = NAVIGATE_WAIT.get(cmd.get("wait", "none"))
+        if wait_until is None:
+            return {"success": False, "error": f"Invalid 'wait' value: {cmd.get('wait')}"}
+        _read_cache.pop(page, None)
+        await page.goto(url, wait_until=wait_until, timeout=timeout_ms)
+        if wait_until == "commit":
+            await page.wait_for_selector("body", state="attached", timeout=timeout_ms)
+        return {"success": True, "data": await extract_readable(page)}
 
     elif action == "Click":
         selector = cmd.get("selector", "")
         if not selector:
             return {"success": False, "error": "Missing 'selector' parameter"}
-        # Try CSS selector first, then text content
+        # A CSS match already on the page wins (count() does not wait). Otherwise
+        # wait for CSS or text in one locator, so a text target does not first
+        # wait out the full timeout on the CSS attempt.
+        css = page.locator(selector)
+        by_text = page.get_by_text(selector, exact=False)
         try:
-            page.click(selector, timeout=timeout_ms)
-        except Exception:
-            # Fallback: try as text
-            page.get_by_text(selector, exact=False).first.click(timeout=timeout_ms)
-        page.wait_for_load_state("domcontentloaded", timeout=timeout_ms)
-        title = page.title()
+            if await css.count():
+                await css.first.click(timeout=timeout_ms)
+            else:
+                await css.or_(by_text).first.click(timeout=timeout_ms)
+        except Exception as e:
+            # Only a selector that does not parse as CSS (rejected before any
+            # wait) retries as text; timeouts and page errors propagate.
+            if "while parsing" not in str(e):
+                raise
+            await by_text.first.click(timeout=timeout_ms)
+        _read_cache.pop(page, None)
+        await page.wait_for_load_state("domcontentloaded", timeout=timeout_ms)
+        title = await page.title()
         return {"success": True, "data": {"clicked": selector, "title": title, "url": page.url}}
 
     elif action == "Type":
@@ -101,18 +278,45 @@ def handle_command(page, context, action, cmd, timeout_ms):
             return {"success": False, "error": "Missing 'selector' parameter"}
         if not text:
             return {"success": False, "error": "Missing 'text' parameter"}
-        page.fill(selector, text, timeout=timeout_ms)
+        await page.fill(selector, text, timeout=timeout_ms)
         return {"success": True, "data": {"typed": text, "selector": selector}}
 
     elif action == "Screenshot":
-        screenshot_bytes = page.screenshot(full_page=False)
-        b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
-        return {"success": True, "data": {"image_base64": b64, "format": "png", "url": page.url}}
+        # JPEG is far cheaper for Chromium to encode and much smaller on the wire
+        image_format = cmd.get("format", "jpeg")
+        if image_format == "jpeg":
+            screenshot_bytes = await page.screenshot(full_page=False, type="jpeg", quality=70)
+        elif image_format == "png":
+            screenshot_bytes = await page.screenshot(full_page=False, type="png")
+        else:
+            return {"success": False, "error": f"Invalid 'format' value: {image_format}"}
+        b64 = binascii.b2a_base64(screenshot_bytes, newline=False).decode("ascii")
+        return {"success": True, "data": {"image_base64": b64, "format": image_format, "url": page.url}}
 
     elif action == "ReadPage":
-        title = page.title()
-        content = extract_readable(page)
-        return {"success": True, "data": {"title": title, "url": page.url, "content": content}}
+        return {"success": True, "data": await extract_readable(page, reuse=True)}
+
+    elif action == "Batch":
+        steps = cmd.get("steps")
+        if not isinstance(steps, list) or not steps:
+            return {"success": False, "error": "Missing 'steps' parameter"}
+        stop_on_error = cmd.get("stopOnError", True)
+        results = []
+        for step in steps:
+            step_action = step.get("action", "") if isinstance(step, dict) else ""
+            if step_action in ("Batch", "Close"):
+                result = {"success": False, "error": f"Action not allowed in Batch: {step_action}"}
+            elif not step_action:
+                result = {"success": False, "error": "Missing 'action' in batch step"}
+            else:
+                try:
+                    result = await handle_command(page, context, step_action, step, timeout_ms)
+                except Exception as e:
+                    result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+            results.append(result)
+            if stop_on_error and not result["success"]:
+                break
+        return {"success": True, "data": {"results": results}}
 
     elif action == "Close":
         return {"success": True, "data": {"status": "closed"}}
@@ -121,67 +325,150 @@ def handle_command(page, context, action, cmd, timeout_ms):
         return {"success": False, "error": f"Unknown action: {action}"}
 
 
-def extract_readable(page):
-    """Extract readable text content from the page, stripping nav/footer/script noise."""
+# Page-side readable-text extractor, built once at import. Removes script,
+# style, nav, footer, header elements; truncation happens in the page so at
+# most maxChars cross the Playwright channel. Title and URL come back in the
+# same call. A MutationObserver left in the page records whether the DOM has
+# changed since the last extraction; if it has not and the caller holds that
+# result, only {cached: true} is returned.
+READABLE_JS = """({maxChars, reuse}) => {
+    const state = window.__openfangRead || (window.__openfangRead = {clean: false, observer: null});
+    if (reuse && state.clean) return {cached: true};
+    if (!state.observer) {
+        state.observer = new MutationObserver(() => { state.clean = false; });
+        state.observer.observe(document, {subtree: true, childList: true, characterData: true, attributes: true});
+    }
+
+    // Script, style and chrome elements are pruned during traversal instead
+    // of cloning the body and deleting them.
+    const SKIP = new Set(['script', 'style', 'nav', 'footer', 'header', 'aside',
+                          'iframe', 'noscript', 'svg', 'canvas']);
+    const SKIP_SELECTOR = [...SKIP].join(', ');
+    const filter = (node) => node.nodeType === 1 && SKIP.has(node.localName)
+        ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT;
+
+    // Try to find main content area outside the skipped elements
+    const main = Array.prototype.find.call(
+        document.querySelectorAll('main, article, [role="main"], .content, #content'),
+        (el) => !el.closest(SKIP_SELECTOR));
+    const source = main || document.body;
+
+    // Text of an element, leaving out skipped descendants when it has any
+    const textOf = (node) => {
+        if (!node.querySelector(SKIP_SELECTOR)) return node.textContent.trim();
+        const parts = [];
+        const inner = document.createTreeWalker(node, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, filter);
+        while (inner.nextNode()) {
+            if (inner.currentNode.nodeType === 3) parts.push(inner.currentNode.nodeValue);
+        }
+        return parts.join('').trim();
+    };
+
+    // Extract text with basic structure. A TreeWalker does the traversal
+    // natively; headings, list items and links emit their text without
+    // descending, and block elements close with a blank line once left.
+    const HEADINGS = new Set(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']);
+    const BLOCKS = new Set(['p', 'div', 'section', 'td', 'th']);
+    const lines = [];
+    const tw = document.createTreeWalker(source, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, filter);
+    // Emit a node's line; returns true if its children should be walked.
+    const enter = (node) => {
+        if (node.nodeType === 3) {
+            const text = node.nodeValue.trim();
+            if (text) lines.push(text);
+            return false;
+        }
+        const tag = node.tagName.toLowerCase();
+        if (HEADINGS.has(tag)) {
+            lines.push('\\n## ' + textOf(node));
+        } else if (tag === 'li') {
+            lines.push('- ' + textOf(node));
+        } else if (tag === 'a' && node.href) {
+            lines.push('[' + textOf(node) + '](' + node.href + ')');
+        } else {
+            return true;
+        }
+        return false;
+    };
+    const leave = (node) => {
+        if (node.nodeType === 1 && BLOCKS.has(node.tagName.toLowerCase())) lines.push('');
+    };
+    let descend = enter(source);
+    while (true) {
+        if (descend && tw.firstChild()) {
+            descend = enter(tw.currentNode);
+            continue;
+        }
+        // Leave the current node, then climb until a next sibling exists
+        let next = false;
+        while (true) {
+            leave(tw.currentNode);
+            if (tw.currentNode === source) break;
+            if (tw.nextSibling()) {
+                next = true;
+                break;
+            }
+            tw.parentNode();
+        }
+        if (!next) break;
+        descend = enter(tw.currentNode);
+    }
+    const text = lines.join('\\n').replace(/\\n{3,}/g, '\\n\\n').trim();
+    const truncated = text.length > maxChars;
+    state.clean = true;
+    return {
+        title: document.title,
+        url: location.href,
+        content: truncated ? text.slice(0, maxChars) : text,
+        total: text.length,
+        truncated: truncated,
+    };
+}"""
+
+
+# Last extraction per page, returned again while the page reports no DOM changes
+_read_cache = weakref.WeakKeyDictionary()
+
+
+async def extract_readable(page, max_chars=50000, reuse=False):
+    """Extract the page title, URL and readable text content, stripping nav/footer/script noise.
+
+    With reuse=True the previous result for this page is returned if its DOM
+    has not changed since.
+    """
+    cached = _read_cache.get(page) if reuse else None
     try:
-        # Remove script, style, nav, footer, header elements
-        content = page.evaluate("""() => {
-            const clone = document.body.cloneNode(true);
-            const remove = ['script', 'style', 'nav', 'footer', 'header', 'aside',
-                           'iframe', 'noscript', 'svg', 'canvas'];
-            remove.forEach(tag => {
-                clone.querySelectorAll(tag).forEach(el => el.remove());
-            });
-
-            // Try to find main content area
-            const main = clone.querySelector('main, article, [role="main"], .content, #content');
-            const source = main || clone;
-
-            // Extract text with basic structure
-            const lines = [];
-            const walk = (node) => {
-                if (node.nodeType === 3) {
-                    const text = node.textContent.trim();
-                    if (text) lines.push(text);
-                } else if (node.nodeType === 1) {
-                    const tag = node.tagName.toLowerCase();
-                    if (['h1','h2','h3','h4','h5','h6'].includes(tag)) {
-                        lines.push('\\n## ' + node.textContent.trim());
-                    } else if (tag === 'li') {
-                        lines.push('- ' + node.textContent.trim());
-                    } else if (tag === 'a' && node.href) {
-                        lines.push('[' + node.textContent.trim() + '](' + node.href + ')');
-                    } else if (['p', 'div', 'section', 'td', 'th'].includes(tag)) {
-                        for (const child of node.childNodes) walk(child);
-                        lines.push('');
-                    } else {
-                        for (const child of node.childNodes) walk(child);
-                    }
-                }
-            };
-            walk(source);
-            return lines.join('\\n').replace(/\\n{3,}/g, '\\n\\n').trim();
-        }""")
-        # Truncate to prevent huge payloads
-        max_chars = 50000
-        if len(content) > max_chars:
-            content = content[:max_chars] + f"\n\n[Truncated — {len(content)} total chars]"
-        return content
+        result = await page.evaluate(READABLE_JS, {"maxChars": max_chars, "reuse": cached is not None})
+        if result.get("cached"):
+            return cached
+        content = result["content"]
+        if result["truncated"]:
+            content += f"\n\n[Truncated — {result['total']} total chars]"
+        data = {"title": result["title"], "url": result["url"], "content": content}
+        _read_cache[page] = data
+        return data
     except Exception:
-        # Fallback: plain innerText
-        try:
-            text = page.inner_text("body")
-            if len(text) > 50000:
-                text = text[:50000] + f"\n\n[Truncated — {len(text)} total chars]"
-            return text
-        except Exception:
-            return "(could not extract page content)"
+        _read_cache.pop(page, None)
+    # Fallback: plain innerText
+    try:
+        text = await page.inner_text("body")
+        if len(text) > max_chars:
+            text = text[:max_chars] + f"\n\n[Truncated — {len(text)} total chars]"
+    except Exception:
+        text = "(could not extract page content)"
+    try:
+        title = await page.title()
+    except Exception:
+        title = ""
+    return {"title": title, "url": page.url, "content": text}
 
 
 def respond(data):
     """Write a JSON response line to stdout."""
-    sys.stdout.write(json.dumps(data) + "\n")
-    sys.stdout.flush()
+    out = sys.stdout.buffer
+    out.write(_dumps(data))
+    out.write(b"\n")
+    out.flush()
 
 
 if __name__ == "__main__":
@@ -24,11 +24,106 @@ Note: This is the REST API *client* library.
       For writing Python agents that run inside OpenFang, see openfang_sdk.py instead.
 """
 
+import http.client
 import json
-from typing import Any, Dict, Generator, Optional
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError
-from urllib.parse import urlencode, quote
+import os
+import select
+import threading
+import weakref
+from typing import Any, Dict, Generator, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+# orjson is used when installed (pip install openfang[fast]); stdlib json otherwise.
+# Bound once: compact separators and raw UTF-8, matching orjson's output
+_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return _encode(obj).encode("utf-8")
+
+
+try:
+    import orjson
+except ImportError:
+    _loads = json.loads
+    _dumps = _json_dumps
+else:
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. ints wider than 64 bits, which only the stdlib encodes
+            return _json_dumps(obj)
+
+# Set OPENFANG_CLIENT_URLLIB=1 to open a fresh urllib connection per request
+# instead of reusing pooled keep-alive connections.
+_USE_URLLIB = os.environ.get("OPENFANG_CLIENT_URLLIB", "") not in ("", "0")
+
+# Errors raised when a kept-alive connection was closed by the server while idle.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+# Methods that may be resent when the connection drops after the request was
+# fully sent: the server may already have acted on a POST/PATCH (e.g. an agent
+# message). A failure while sending is retried for every method.
+_IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "PUT", "DELETE", "OPTIONS"))
+
+
+def _is_dropped(conn: http.client.HTTPConnection) -> bool:
+    """True if an idle pooled socket was closed by the peer.
+
+    An idle keep-alive socket has nothing to read; if select reports it
+    readable, the server has sent EOF (or an error) and it must not be reused.
+    """
+    if conn.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def _uses_proxy(scheme: str, host: str) -> bool:
+    """True if the environment routes this host through an HTTP(S) proxy."""
+    if not any(k.lower() == f"{scheme}_proxy" for k in os.environ):
+        return False
+    from urllib.request import getproxies, proxy_bypass
+
+    return scheme in getproxies() and not proxy_bypass(host)
+
+
+class _ConnHolder:
+    """Per-thread slot for a pooled connection; dropped when its thread exits."""
+
+    conn = None
+
+
+def _close_conns(conns: list, lock: threading.Lock) -> None:
+    with lock:
+        pending = list(conns)
+    for conn in pending:
+        conn.close()
+
+
+def _release_conn(conns: list, lock: threading.Lock, conn: http.client.HTTPConnection) -> None:
+    with lock:
+        if conn in conns:
+            conns.remove(conn)
+    conn.close()
+
+
+def _decode_event(data: bytes) -> Dict:
+    try:
+        return _loads(data)
+    except ValueError:
+        return {"raw": data.decode("utf-8", "replace")}
 
 
 class OpenFangError(Exception):
@@ -44,14 +139,41 @@ class _Resource:
 
 
 class OpenFang:
-    """OpenFang REST API client. Zero dependencies — uses only stdlib urllib."""
+    """OpenFang REST API client. Zero dependencies — uses only the stdlib.
+
+    Requests reuse a keep-alive connection per thread. Connections are closed
+    when their thread exits, when the client is garbage collected or used as a
+    context manager, or on ``close()``. A pooled socket the server has closed
+    is replaced before use, and a request that fails while being sent is
+    retried once. A POST/PATCH that loses its connection after being sent
+    raises rather than risk running twice.
+
+    The pooled path does not follow HTTP redirects. When an HTTP(S) proxy is
+    configured for the host (``http_proxy``/``https_proxy``, honouring
+    ``no_proxy``), or OPENFANG_CLIENT_URLLIB=1 is set, requests go through
+    urllib instead, which handles both.
+    """
 
     def __init__(self, base_url: str, headers: Optional[Dict[str, str]] = None):
         self.base_url = base_url.rstrip("/")
-        self._headers = {"Content-Type": "application/json"}
+        self._headers = {"Content-Type": "application/json; charset=utf-8"}
         if headers:
             self._headers.update(headers)
 
+        parts = urlsplit(self.base_url)
+        self._conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host = parts.hostname or "localhost"
+        self._port = parts.port
+        self._base_path = parts.path
+        self._use_urllib = _USE_URLLIB or _uses_proxy(parts.scheme or "http", self._host)
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        # Runs on garbage collection or at interpreter exit, without keeping self alive
+        self._finalizer = weakref.finalize(self, _close_conns, self._conns, self._conns_lock)
+        # Cleared once the server answers 404/405 for the batch endpoint
+        self._batch_supported = True
+
         self.agents = _AgentResource(self)
         self.sessions = _SessionResource(self)
         self.workflows = _WorkflowResource(self)
@@ -64,25 +186,96 @@ class OpenFang:
         self.triggers = _TriggerResource(self)
         self.schedules = _ScheduleResource(self)
 
+    def close(self) -> None:
+        """Close all pooled connections. The client stays usable and reconnects on demand."""
+        _close_conns(self._conns, self._conns_lock)
+
+    def __enter__(self) -> "OpenFang":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ConnHolder()
+            holder.conn = self._conn_cls(self._host, self._port)
+            with self._conns_lock:
+                self._conns.append(holder.conn)
+            # The thread-local holder is freed when its thread exits
+            weakref.finalize(holder, _release_conn, self._conns, self._conns_lock, holder.conn)
+        return holder.conn
+
     def _request(self, method: str, path: str, body: Any = None) -> Any:
+        if self._use_urllib:
+            return self._request_urllib(method, path, body)
+        data = _dumps(body) if body is not None else None
+        url = self._base_path + path
+        conn = self._connection()
+        if _is_dropped(conn):
+            # Server/proxy idle timeout closed the kept-alive socket; reconnect
+            conn.close()
+        try:
+            try:
+                conn.request(method, url, body=data, headers=self._headers)
+            except _STALE_CONNECTION_ERRORS:
+                # Failed while sending, so the server never got the whole
+                # request: resending on a fresh socket is safe for any method
+                conn.close()
+                conn.request(method, url, body=data, headers=self._headers)
+            try:
+                resp = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                if method not in _IDEMPOTENT_METHODS:
+                    raise
+                conn.close()
+                conn.request(method, url, body=data, headers=self._headers)
+                resp = conn.getresponse()
+            raw = resp.read()
+        except BaseException:
+            # Reset the connection so the next call starts clean instead of
+            # failing with CannotSendRequest
+            conn.close()
+            raise
+        if resp.status >= 400:
+            text = raw.decode()
+            raise OpenFangError(f"HTTP {resp.status}: {text}", resp.status, text)
+        ct = resp.getheader("content-type", "")
+        if "application/json" in ct:
+            return _loads(raw)
+        return raw.decode()
+
+    def _request_urllib(self, method: str, path: str, body: Any = None) -> Any:
+        # urllib.request is only needed on this fallback path and for streaming
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+
         url = self.base_url + path
-        data = json.dumps(body).encode() if body is not None else None
+        data = _dumps(body) if body is not None else None
         req = Request(url, data=data, headers=self._headers, method=method)
         try:
             with urlopen(req) as resp:
                 ct = resp.headers.get("content-type", "")
-                text = resp.read().decode()
+                raw = resp.read()
                 if "application/json" in ct:
-                    return json.loads(text)
-                return text
+                    return _loads(raw)
+                return raw.decode()
         except HTTPError as e:
             body_text = e.read().decode() if e.fp else ""
             raise OpenFangError(f"HTTP {e.code}: {body_text}", e.code, body_text) from e
 
     def _stream(self, method: str, path: str, body: Any = None) -> Generator[Dict, None, None]:
-        """SSE streaming. Yields parsed JSON events."""
+        """SSE streaming. Yields parsed JSON events.
+
+        Nothing is sent until the first event is requested; the connection is
+        closed when iteration finishes or the generator is closed.
+        """
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+
         url = self.base_url + path
-        data = json.dumps(body).encode() if body is not None else None
+        data = _dumps(body) if body is not None else None
         headers = dict(self._headers)
         headers["Accept"] = "text/event-stream"
         req = Request(url, data=data, headers=headers, method=method)
@@ -92,25 +285,58 @@ class OpenFang:
             body_text = e.read().decode() if e.fp else ""
             raise OpenFangError(f"HTTP {e.code}: {body_text}", e.code, body_text) from e
 
-        buffer = ""
-        while True:
-            chunk = resp.read(4096)
-            if not chunk:
-                break
-            buffer += chunk.decode()
-            lines = buffer.split("\n")
-            buffer = lines.pop()
-            for line in lines:
-                line = line.strip()
-                if line.startswith("data: "):
-                    data_str = line[6:]
-                    if data_str == "[DONE]":
-                        return
-                    try:
-                        yield json.loads(data_str)
-                    except json.JSONDecodeError:
-                        yield {"raw": data_str}
-        resp.close()
+        # Close the response however iteration ends: [DONE], exhaustion, an
+        # error, or the caller dropping the generator (GeneratorExit).
+        try:
+            # Work on raw bytes and decode only complete payloads. Only the newest
+            # chunk is searched for a line break, so a long event arriving over
+            # many reads is never rescanned.
+            buf = bytearray()
+            data_lines = []
+            while True:
+                chunk = resp.read(4096)
+                if not chunk:
+                    break
+                nl = chunk.rfind(b"\n")
+                if nl == -1:
+                    buf.extend(chunk)
+                    continue
+                if buf:
+                    # Slow path: complete the line carried over from earlier reads
+                    buf.extend(chunk[:nl])
+                    lines = bytes(buf).split(b"\n")
+                    buf = bytearray(chunk[nl + 1:])
+                else:
+                    # Fast path: the read holds whole lines (typically whole
+                    # "data: ...\n\n" events), so split it without buffering
+                    lines = chunk[:nl].split(b"\n")
+                    if nl + 1 < len(chunk):
+                        buf.extend(chunk[nl + 1:])
+                for line in lines:
+                    if line.endswith(b"\r"):
+                        line = line[:-1]
+                    if line:
+                        if line.startswith(b"data:"):
+                            data_lines.append(line[6:] if line.startswith(b"data: ") else line[5:])
+                        continue
+                    # A blank line terminates the event; multi-line data is joined
+                    if data_lines:
+                        data = b"\n".join(data_lines)
+                        data_lines = []
+                        if data == b"[DONE]":
+                            return
+                        yield _decode_event(data)
+            # The stream may end on a line with no trailing newline
+            if buf:
+                line = bytes(buf).rstrip(b"\r")
+                if line.startswith(b"data:"):
+                    data_lines.append(line[6:] if line.startswith(b"data: ") else line[5:])
+            if data_lines:
+                data = b"\n".join(data_lines)
+                if data != b"[DONE]":
+                    yield _decode_event(data)
+        finally:
+            resp.close()
 
     def health(self) -> Any:
         return self._request("GET", "/api/health")
@@ -169,6 +395,22 @@ class _AgentResource(_Resource):
         body = {"message": text, **opts}
         return self._c._request("POST", f"/api/agents/{agent_id}/message", body)
 
+    def message_many(self, pairs: List[Tuple[str, str]], **opts) -> List[Any]:
+        """Send several (agent_id, text) messages; returns the replies in order.
+
+        Uses the batch endpoint when the server provides one, otherwise sends
+        the messages one by one over the client's kept-alive connection.
+        """
+        if self._c._batch_supported:
+            body = [{"agent_id": agent_id, "message": text, **opts} for agent_id, text in pairs]
+            try:
+                return self._c._request("POST", "/api/agents/_/messages/batch", body)
+            except OpenFangError as e:
+                if e.status not in (404, 405):
+                    raise
+                self._c._batch_supported = False
+        return [self.message(agent_id, text, **opts) for agent_id, text in pairs]
+
     def stream(self, agent_id: str, text: str, **opts) -> Generator[Dict, None, None]:
         """Stream response events. Usage:
             for event in client.agents.stream(id, "Hello"):
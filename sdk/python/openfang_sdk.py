@@ -27,11 +27,32 @@ import os
 import sys
 from typing import Callable, Optional, Dict, Any
 
+# orjson, when installed, encodes straight to bytes; stdlib json otherwise.
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj).encode("utf-8")
+
+
+try:
+    import orjson
+except ImportError:
+    _loads = json.loads
+    _dumps = _json_dumps
+else:
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. ints wider than 64 bits, which only the stdlib encodes
+            return _json_dumps(obj)
+
 
 def read_input() -> Dict[str, Any]:
     """Read the input JSON from stdin (sent by the OpenFang kernel)."""
-    line = sys.stdin.readline().strip()
-    if not line:
+    # Read raw bytes: the JSON decoder accepts UTF-8 bytes and surrounding whitespace
+    line = sys.stdin.buffer.readline()
+    if not line or line.isspace():
         # Fallback: check environment variables
         agent_id = os.environ.get("OPENFANG_AGENT_ID", "")
         message = os.environ.get("OPENFANG_MESSAGE", "")
@@ -41,7 +62,7 @@ def read_input() -> Dict[str, Any]:
             "message": message,
             "context": {},
         }
-    return json.loads(line)
+    return _loads(line)
 
 
 def respond(text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
@@ -49,7 +70,15 @@ def respond(text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
     response = {"type": "response", "text": text}
     if metadata:
         response["metadata"] = metadata
-    print(json.dumps(response), flush=True)
+    # Write the encoded payload and the newline separately so a large
+    # response is never copied just to append "\n". Flush the text layer
+    # first so anything the agent print()ed stays ahead of the response line.
+    payload = _dumps(response)
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    out.write(payload)
+    out.write(b"\n")
+    out.flush()
 
 
 def log(message: str, level: str = "info") -> None:
@@ -6,6 +6,7 @@ setup(
     description="Official Python client for the OpenFang Agent OS REST API",
     py_modules=["openfang_sdk", "openfang_client"],
     python_requires=">=3.8",
+    extras_require={"fast": ["orjson"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",